@@ -4,10 +4,9 @@ import asyncio
 import logging
 from discord.ext import commands
 import discord
-from player import MusicManager
+from player import MusicManager, is_playlist_url
 
-from threading import Thread
-from flask import Flask
+from aiohttp import web
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("metrolist-bot")
@@ -20,6 +19,9 @@ intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
 music = MusicManager()
+keepalive_runner: web.AppRunner | None = None
+
+EMBED_COLOR = 0x1DB954
 
 
 @bot.event
@@ -28,6 +30,13 @@ async def on_ready():
     logger.info("Ready!")
 
 
+@bot.event
+async def setup_hook():
+    # Runs once, before connecting to the gateway, so the port is bound early
+    if os.getenv("ENABLE_KEEPALIVE", "1") == "1":
+        await start_keepalive()
+
+
 @bot.command(name="play")
 async def play(ctx, *, query: str):
     async with ctx.typing():
@@ -39,10 +48,33 @@ async def play(ctx, *, query: str):
             channel = ctx.author.voice.channel
             vc = await channel.connect()
         player = music.get_player(ctx.guild.id, bot.loop, vc)
+        if is_playlist_url(query):
+            entries = await player.resolve_playlist(query)
+            if not entries:
+                await ctx.send("That playlist is empty or unavailable.")
+                return
+            tracks = await player.queue_playlist(entries, requester=ctx.author)
+            if not tracks:
+                await ctx.send("None of the tracks in that playlist could be queued.")
+                return
+            description = f"{len(tracks)} tracks"
+            skipped = len(entries) - len(tracks)
+            if skipped:
+                description += f" ({skipped} unavailable, skipped)"
+            await ctx.send(
+                embed=discord.Embed.from_dict(
+                    {
+                        "title": "Queued playlist",
+                        "description": description,
+                        "color": EMBED_COLOR,
+                    }
+                )
+            )
+            return
         entry = await player.queue_entry(query, requester=ctx.author)
         await ctx.send(
-            embed=discord.Embed(
-                title="Queued", description=f"{entry.title}", color=0x1DB954
+            embed=discord.Embed.from_dict(
+                {"title": "Queued", "description": entry.title, "color": EMBED_COLOR}
             )
         )
 
@@ -101,7 +133,7 @@ async def show_queue(ctx):
             f"🎶 Now playing: {player.current.title} ({player.current.requester.display_name})"
         )
 
-    upcoming = list(player.queue._queue)[:10]
+    upcoming = player.queue.peek(10)
     for i, track in enumerate(upcoming, start=1):
         lines.append(f"{i}. {track.title} ({track.requester.display_name})")
 
@@ -109,11 +141,18 @@ async def show_queue(ctx):
         await ctx.send("Queue is empty.")
         return
 
+    # Nothing upcoming: the now-playing line alone doesn't need an embed
+    if not upcoming:
+        await ctx.send(lines[0])
+        return
+
     await ctx.send(
-        embed=discord.Embed(
-            title=f"Queue for {ctx.guild.name}",
-            description="\n".join(lines),
-            color=0x1DB954,
+        embed=discord.Embed.from_dict(
+            {
+                "title": f"Queue for {ctx.guild.name}",
+                "description": "\n".join(lines),
+                "color": EMBED_COLOR,
+            }
         )
     )
 
@@ -143,21 +182,34 @@ async def helpme(ctx):
     await ctx.send(f"```\n{help_text}\n```")
 
 
-# Flask keepalive
-app = Flask("keepalive")
+# aiohttp keepalive, served from the bot's own event loop
+async def index(request):
+    return web.Response(text="Metrolist-style Discord bot is running.")
 
 
-@app.route("/")
-def index():
-    return "Metrolist-style Discord bot is running."
+async def start_keepalive():
+    global keepalive_runner
+    app = web.Application()
+    app.router.add_get("/", index)
+    keepalive_runner = web.AppRunner(app)
+    await keepalive_runner.setup()
+    site = web.TCPSite(keepalive_runner, "0.0.0.0", int(os.getenv("PORT", 5000)))
+    await site.start()
 
 
-def run_flask():
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
+async def main():
+    async with bot:
+        try:
+            await bot.start(DISCORD_TOKEN)
+        finally:
+            if keepalive_runner is not None:
+                await keepalive_runner.cleanup()
 
 
 if __name__ == "__main__":
-    if os.getenv("ENABLE_KEEPALIVE", "1") == "1":
-        t = Thread(target=run_flask, daemon=True)
-        t.start()
-    bot.run(DISCORD_TOKEN)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        music.shutdown()
@@ -10,12 +10,28 @@ Features:
 """
 
 import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
 import discord
 import functools
+from itertools import islice
+import logging
 import os
+import re
 import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
 
 # ---------- yt-dlp options ----------
 YTDL_OPTS = {
@@ -28,117 +44,343 @@ YTDL_OPTS = {
 
 FFMPEG_OPTIONS = "-nostdin -hide_banner"
 
+# Opt in to tmpfs downloads with USE_TMPFS=1; it is often small (64 MB in Docker)
+if os.getenv("USE_TMPFS", "0") == "1" and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+    DOWNLOAD_DIR = "/dev/shm"
+else:
+    DOWNLOAD_DIR = tempfile.gettempdir()
+
+YTDL_DOWNLOAD_OPTS = {
+    **YTDL_OPTS,
+    "outtmpl": os.path.join(DOWNLOAD_DIR, "%(id)s.%(ext)s"),
+}
+
+# Flat extraction only lists a playlist's entries without resolving each one
+YTDL_PLAYLIST_OPTS = {
+    **YTDL_OPTS,
+    "noplaylist": False,
+    "extract_flat": "in_playlist",
+}
+
+_HTTP_PREFIXES = ("http://", "https://")
+_SEARCH_PREFIX = "ytsearch1:"
+
+# Caps yt-dlp extractions across all guilds to stay under YouTube's 429 threshold
+_EXTRACT_SEM = asyncio.Semaphore(int(os.getenv("YTDL_CONCURRENCY", "6")))
+# Downloads extract too (playlist tracks resolve their page URL at download time),
+# so they get their own cap; sharing one would let minute-long downloads block !play
+_DOWNLOAD_SEM = asyncio.Semaphore(int(os.getenv("YTDL_DOWNLOAD_CONCURRENCY", "3")))
+
 YTDL = yt_dlp.YoutubeDL(YTDL_OPTS)
+YTDL_PLAYLIST = yt_dlp.YoutubeDL(YTDL_PLAYLIST_OPTS)
+# One downloader per download thread, reused across tracks, so parallel downloads
+# don't share one instance's in-progress download state. YTDL and YTDL_PLAYLIST
+# stay shared across extraction threads, as the metadata lookups always were.
+_YTDL_DOWNLOAD_LOCAL = threading.local()
+
+# ---------- faster JSON parsing ----------
+# yt-dlp parses page/API JSON with the stdlib decoder; try orjson first and
+# fall back to yt-dlp's lenient decoder for anything orjson rejects.
+# orjson turns integers beyond 64 bits into floats, so any document with a
+# run of 19+ digits goes to the stdlib decoder to keep them exact.
+_LONG_DIGITS = re.compile(r"\d{19,}")
+
+if orjson is not None:
+    _stdlib_parse_json = InfoExtractor._parse_json
+
+    @functools.wraps(_stdlib_parse_json)
+    def _orjson_parse_json(self, json_string, video_id, transform_source=None, fatal=True, errnote=None, **parser_kwargs):
+        if (
+            transform_source is None
+            and not parser_kwargs
+            and isinstance(json_string, str)
+            and not _LONG_DIGITS.search(json_string)
+        ):
+            try:
+                return orjson.loads(json_string)
+            except (orjson.JSONDecodeError, TypeError):
+                pass
+        return _stdlib_parse_json(self, json_string, video_id, transform_source, fatal, errnote, **parser_kwargs)
+
+    InfoExtractor._parse_json = _orjson_parse_json
+
+# ---------- extract_info cache ----------
+# Direct stream URLs can rotate, so keep entries short-lived
+EXTRACT_CACHE_TTL = 300
+EXTRACT_CACHE_MAXSIZE = 128
+_CACHE_FIELDS = ("title", "url", "webpage_url", "duration", "acodec")
+_CACHE: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+_CACHE_LOCK = threading.Lock()
 
 # ---------- Track dataclass ----------
-@dataclass
+@dataclass(slots=True)
 class Track:
     title: str
     url: str
     source_url: str
     duration: int
     requester: discord.Member
+    codec: str | None = None  # audio codec reported by yt-dlp
     file_path: str | None = None  # temp file path after download
+    prefetch_task: asyncio.Task | None = None  # pending background download
+
+# ---------- TrackQueue ----------
+class TrackQueue:
+    """
+    FIFO of upcoming tracks. Unlike asyncio.Queue, the pending tracks can be
+    inspected with peek() without reaching into private state.
+    """
+
+    def __init__(self):
+        self._dq: deque[Track] = deque()
+        self._not_empty = asyncio.Event()
+
+    async def put(self, track: Track):
+        self._dq.append(track)
+        self._not_empty.set()
+
+    async def get(self) -> Track:
+        while not self._dq:
+            await self._not_empty.wait()
+        track = self._dq.popleft()
+        if not self._dq:
+            self._not_empty.clear()
+        return track
+
+    def peek(self, n: int = 1) -> list[Track]:
+        return list(islice(self._dq, 0, n))
+
+    def empty(self) -> bool:
+        return not self._dq
+
+    def clear(self):
+        self._dq.clear()
+        self._not_empty.clear()
 
 # ---------- MusicPlayer ----------
 class MusicPlayer:
-    def __init__(self, guild_id: int, loop: asyncio.AbstractEventLoop, voice_client: discord.VoiceClient):
+    def __init__(self, guild_id: int, loop: asyncio.AbstractEventLoop, voice_client: discord.VoiceClient, extract_pool: ThreadPoolExecutor | None = None, download_pool: ThreadPoolExecutor | None = None):
         self.guild_id = guild_id
         self.loop = loop
+        self.extract_pool = extract_pool
+        self.download_pool = download_pool
         self.voice_client = voice_client
-        self.queue = asyncio.Queue()
+        self.queue = TrackQueue()
         self.current: Track | None = None
         self.play_next_event = asyncio.Event()
         self.auto_disconnect_task: asyncio.Task | None = None
+        self._deadline: float = 0
+        self._disconnect_waker = asyncio.Event()
         self._task = self.loop.create_task(self.player_loop())
 
     async def queue_entry(self, query: str, requester: discord.Member) -> Track:
-        info = await self.loop.run_in_executor(None, functools.partial(extract_info, query))
-        track = Track(
+        # Cache hits skip the extraction gate and the executor hop
+        info = cached_info(query) or await self._run_extractor(extract_info, query)
+        track = self._make_track(info, requester)
+        await self._enqueue([track])
+        return track
+
+    async def resolve_playlist(self, query: str) -> list[dict]:
+        return await self._run_extractor(extract_playlist, query)
+
+    async def queue_playlist(self, entries: list[dict], requester: discord.Member) -> list[Track]:
+        # The flat listing already has title and duration, so tracks are built from it
+        # directly; each one is resolved when it's downloaded, from its page URL, since
+        # signed stream URLs would expire long before the end of a big playlist
+        tracks = []
+        for entry in entries:
+            if not entry.get("url"):
+                logger.warning("Skipping playlist entry %s: no URL", entry.get("title") or entry.get("id"))
+                continue
+            tracks.append(
+                Track(
+                    title=entry.get("title"),
+                    url=entry["url"],
+                    source_url=entry["url"],
+                    duration=entry.get("duration") or 0,
+                    requester=requester,
+                )
+            )
+        await self._enqueue(tracks)
+        return tracks
+
+    async def _run_extractor(self, func, *args):
+        async with _EXTRACT_SEM:
+            return await self.loop.run_in_executor(self.extract_pool, func, *args)
+
+    def _make_track(self, info: dict, requester: discord.Member) -> Track:
+        return Track(
             title=info.get("title"),
             url=info.get("url"),
             source_url=info.get("webpage_url"),
             duration=info.get("duration") or 0,
             requester=requester,
+            codec=info.get("acodec"),
         )
-        await self.queue.put(track)
+
+    async def _enqueue(self, tracks: list[Track]):
+        for track in tracks:
+            await self.queue.put(track)
+        # Start downloading right away if one of these tracks plays next
+        if tracks and self.current is not None and self.queue.peek()[0] is tracks[0]:
+            self._schedule_prefetch(tracks[0])
         # Reset auto-disconnect timer
         await self.start_auto_disconnect()
-        return track
 
     async def player_loop(self):
         while True:
             self.play_next_event.clear()
             self.current = await self.queue.get()
 
-            # Download track fully before playing
-            self.current.file_path = await self.loop.run_in_executor(None, download_track, self.current.url)
+            try:
+                # Download track fully before playing (usually already done by the prefetch)
+                # Shielded so cancelling the loop leaves the download for _drop_download to clean up
+                self._schedule_prefetch(self.current)
+                await asyncio.shield(self.current.prefetch_task)
+                # Same video queued back to back shares a file the previous track just removed
+                if not os.path.exists(self.current.file_path):
+                    self.current.file_path = None
+                    self.current.prefetch_task = None
+                    self._schedule_prefetch(self.current)
+                    await asyncio.shield(self.current.prefetch_task)
 
-            source = discord.FFmpegPCMAudio(
-                self.current.file_path,
-                before_options=FFMPEG_OPTIONS,
-                executable=os.getenv("FFMPEG_PATH", "ffmpeg")
-            )
+                # Opus downloads are passed through as-is; anything else is encoded once by FFmpeg.
+                # yt-dlp already told us the codec, so skip spawning ffprobe when it's Opus.
+                if self.current.codec == "opus":
+                    source = discord.FFmpegOpusAudio(
+                        self.current.file_path,
+                        codec="copy",
+                        before_options=FFMPEG_OPTIONS,
+                        executable=os.getenv("FFMPEG_PATH", "ffmpeg")
+                    )
+                else:
+                    source = await discord.FFmpegOpusAudio.from_probe(
+                        self.current.file_path,
+                        before_options=FFMPEG_OPTIONS,
+                        executable=os.getenv("FFMPEG_PATH", "ffmpeg")
+                    )
+            except Exception:
+                # A failed download must not kill the loop; skip to the next track
+                logger.exception("Skipping %s: could not load track", self.current.title)
+                remove_track_file(self.current.file_path)
+                self.current = None
+                await self.start_auto_disconnect()
+                continue
 
             def after_playing(err):
                 if err:
-                    print("Player error:", err)
+                    logger.error("Player error: %s", err)
                 # cleanup temp file
-                if self.current and self.current.file_path:
-                    try:
-                        os.remove(self.current.file_path)
-                    except Exception:
-                        pass
+                if self.current:
+                    remove_track_file(self.current.file_path)
                 self.loop.call_soon_threadsafe(self.play_next_event.set)
 
             self.voice_client.play(source, after=after_playing)
+            # Download the next track while this one plays
+            for next_track in self.queue.peek():
+                self._schedule_prefetch(next_track)
             await self.play_next_event.wait()
             self.current = None
             # Start auto-disconnect after finishing song
             await self.start_auto_disconnect()
 
+    def _schedule_prefetch(self, track: Track):
+        if track.file_path is None and track.prefetch_task is None:
+            track.prefetch_task = self.loop.create_task(self._prefetch(track))
+
+    async def _prefetch(self, track: Track):
+        async with _DOWNLOAD_SEM:
+            track.file_path = await self.loop.run_in_executor(self.download_pool, download_track, track.url)
+
+    def _drop_download(self, track: Track):
+        # The download may still be running in a worker thread; remove the file once it lands
+        if track.prefetch_task is None:
+            remove_track_file(track.file_path)
+            return
+
+        def cleanup(task: asyncio.Task):
+            # Retrieve the exception so a failed prefetch isn't reported as never retrieved
+            if task.cancelled() or task.exception() is not None:
+                return
+            remove_track_file(track.file_path)
+
+        track.prefetch_task.add_done_callback(cleanup)
+
+    def _clear_queue(self):
+        # Only the head of the queue is ever prefetched; drop its download too
+        for next_track in self.queue.peek():
+            self._drop_download(next_track)
+        self.queue.clear()
+
+    def _release_downloads(self):
+        self._clear_queue()
+        if self.current:
+            self._drop_download(self.current)
+
     async def skip(self):
         if self.voice_client.is_playing():
             self.voice_client.stop()
 
     async def stop(self):
-        while not self.queue.empty():
-            try:
-                self.queue.get_nowait()
-                self.queue.task_done()
-            except asyncio.QueueEmpty:
-                break
+        self._clear_queue()
         if self.voice_client.is_playing() or self.voice_client.is_paused():
             self.voice_client.stop()
         await self.start_auto_disconnect()
 
     async def start_auto_disconnect(self, timeout: int = 300):
-        if self.auto_disconnect_task and not self.auto_disconnect_task.done():
-            self.auto_disconnect_task.cancel()
-        self.auto_disconnect_task = self.loop.create_task(self._auto_disconnect(timeout))
+        # Push the deadline back and wake the single long-lived timer task
+        self._deadline = self.loop.time() + timeout
+        if self.auto_disconnect_task is None or self.auto_disconnect_task.done():
+            self.auto_disconnect_task = self.loop.create_task(self._auto_disconnect())
+        else:
+            self._disconnect_waker.set()
 
-    async def _auto_disconnect(self, timeout: int):
-        await asyncio.sleep(timeout)
-        if not self.voice_client or not self.voice_client.is_connected():
-            return
-        # Leave immediately if alone
-        if len(self.voice_client.channel.members) == 1:
-            await self.voice_client.disconnect()
-            return
-        # Wait a short time for FFmpeg to finalize
-        await asyncio.sleep(1)
-        # Disconnect if nothing is playing and queue is empty
-        if not self.voice_client.is_playing() and self.queue.empty() and self.current is None:
-            await self.voice_client.disconnect()
+    async def _auto_disconnect(self):
+        while True:
+            self._disconnect_waker.clear()
+            delay = self._deadline - self.loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._disconnect_waker.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if not self.voice_client or not self.voice_client.is_connected():
+                return
+            # Leave immediately if alone
+            if len(self.voice_client.channel.members) == 1:
+                self._release_downloads()
+                await self.voice_client.disconnect()
+                return
+            # Wait a short time for FFmpeg to finalize
+            await asyncio.sleep(1)
+            # Disconnect if nothing is playing and queue is empty
+            if not self.voice_client.is_playing() and self.queue.empty() and self.current is None:
+                await self.voice_client.disconnect()
+                return
+            # Still busy; sleep until the timer is reset again
+            if self._deadline <= self.loop.time():
+                await self._disconnect_waker.wait()
 
 # ---------- MusicManager ----------
 class MusicManager:
     def __init__(self):
         self.players: dict[int, MusicPlayer] = {}
+        # Dedicated pool for yt-dlp so slow extractions don't starve the default executor
+        self.extract_pool = ThreadPoolExecutor(
+            max_workers=min(8, 2 * (os.cpu_count() or 1)),
+            thread_name_prefix="ytdlp",
+        )
+        # Downloads take minutes and are network-bound; keep them off the extraction pool
+        self.download_pool = ThreadPoolExecutor(
+            max_workers=min(16, 4 + 2 * (os.cpu_count() or 1)),
+            thread_name_prefix="ytdlp-download",
+        )
 
     def get_player(self, guild_id: int, loop: asyncio.AbstractEventLoop, voice_client: discord.VoiceClient) -> MusicPlayer:
         if guild_id not in self.players:
-            self.players[guild_id] = MusicPlayer(guild_id, loop, voice_client)
+            self.players[guild_id] = MusicPlayer(guild_id, loop, voice_client, self.extract_pool, self.download_pool)
         return self.players[guild_id]
 
     def get_player_if_exists(self, guild_id: int):
@@ -147,6 +389,7 @@ class MusicManager:
     async def disconnect(self, guild_id: int):
         player = self.players.get(guild_id)
         if player:
+            player._release_downloads()
             if player.voice_client:
                 try:
                     await player.voice_client.disconnect()
@@ -158,30 +401,82 @@ class MusicManager:
                 player.auto_disconnect_task.cancel()
             del self.players[guild_id]
 
+    def shutdown(self):
+        self.extract_pool.shutdown(wait=False, cancel_futures=True)
+        self.download_pool.shutdown(wait=False, cancel_futures=True)
+
 # ---------- yt-dlp helper functions ----------
+def _cache_key(query: str) -> str:
+    if query.startswith(_HTTP_PREFIXES):
+        return query
+    return _SEARCH_PREFIX + query.strip().lower()
+
+def cached_info(query: str) -> dict | None:
+    """
+    Returns a copy of the cached extract_info result for query, or None.
+    """
+    key = _cache_key(query)
+    now = time.monotonic()
+    with _CACHE_LOCK:
+        for expired in [k for k, (expires, _) in _CACHE.items() if expires <= now]:
+            del _CACHE[expired]
+        cached = _CACHE.get(key)
+        if cached:
+            _CACHE.move_to_end(key)
+            return dict(cached[1])
+    return None
+
 def extract_info(query: str) -> dict:
-    if query.startswith("http"):
+    cached = cached_info(query)
+    if cached:
+        return cached
+
+    if query.startswith(_HTTP_PREFIXES):
         inq = query
     else:
-        inq = f"ytsearch1:{query}"
+        inq = _SEARCH_PREFIX + query
     info = YTDL.extract_info(inq, download=False)
     if "entries" in info:
         info = info["entries"][0]
+
+    key = _cache_key(query)
+    with _CACHE_LOCK:
+        _CACHE[key] = (time.monotonic() + EXTRACT_CACHE_TTL, {k: info.get(k) for k in _CACHE_FIELDS})
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > EXTRACT_CACHE_MAXSIZE:
+            _CACHE.popitem(last=False)
     return info
 
+def is_playlist_url(query: str) -> bool:
+    # Only real playlist pages; a watch link copied from a playlist or Mix plays that one video
+    if not query.startswith(_HTTP_PREFIXES):
+        return False
+    parsed = urlparse(query)
+    list_id = parse_qs(parsed.query).get("list", [""])[0]
+    # RD... lists are auto-generated Mixes with no fixed end
+    return parsed.path == "/playlist" and bool(list_id) and not list_id.startswith("RD")
+
+def extract_playlist(url: str) -> list[dict]:
+    """
+    Lists the entries of a playlist without resolving each one.
+    """
+    info = YTDL_PLAYLIST.extract_info(url, download=False)
+    return [e for e in info.get("entries") or [] if e]
+
 def download_track(track_url: str) -> str:
     """
     Fully downloads the track to a temp file and returns the file path.
     """
-    ytdl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": os.path.join(tempfile.gettempdir(), "%(id)s.%(ext)s"),
-        "quiet": True,
-        "no_warnings": True,
-        "cookiefile": "cookies.txt",
-        "noplaylist": True,
-    }
-    with yt_dlp.YoutubeDL(ytdl_opts) as ydl:
-        info = ydl.extract_info(track_url, download=True)
-        filename = ydl.prepare_filename(info)
-        return filename
+    ydl = getattr(_YTDL_DOWNLOAD_LOCAL, "ydl", None)
+    if ydl is None:
+        ydl = _YTDL_DOWNLOAD_LOCAL.ydl = yt_dlp.YoutubeDL(YTDL_DOWNLOAD_OPTS)
+    info = ydl.extract_info(track_url, download=True)
+    return ydl.prepare_filename(info)
+
+def remove_track_file(file_path: str | None):
+    if not file_path:
+        return
+    try:
+        os.remove(file_path)
+    except Exception:
+        pass